@@ -1,16 +1,21 @@
 # pyright:strict
 
 
-from bs4 import BeautifulSoup, Tag
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Generator, List, cast
-import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from hashlib import blake2b
+from pathlib import Path
+from selectolax.parser import HTMLParser, Node
+from typing import Dict, Generator, List, Optional, Tuple
 import json
+import orjson
+import re
 import requests
+import sys
+import threading
 
 
-@dataclass
+@dataclass(slots=True)
 class Course:
     class_name: str
     location: str
@@ -24,11 +29,96 @@ class Course:
     days: str
     times: str
     fee: str
-    start_time: datetime
-    end_time: datetime
+    # minutes since midnight
+    start_min: int
+    end_min: int
+    class_name_lc: str = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.class_name_lc = self.class_name.lower()
+
+    def to_json_dict(self) -> Dict[str, str | int]:
+        return {
+            "class_name": self.class_name,
+            "location": self.location,
+            "instructor": self.instructor,
+            "session": self.session,
+            "gender": self.gender,
+            "age": self.age,
+            "open": self.open,
+            "cat2": self.cat2,
+            "cat3": self.cat3,
+            "days": self.days,
+            "times": self.times,
+            "fee": self.fee,
+            "start_min": self.start_min,
+            "end_min": self.end_min,
+        }
+
+
+# filters; LOCATION and EXCLUDED_DAYS are also applied while parsing, so edit
+# them here rather than in relevant()
+START_AFTER_MIN = 17 * 60  # 5:00pm
+END_BEFORE_MIN = 19 * 60 + 30  # 7:30pm
+LOCATION = "SB"
+EXCLUDED_DAYS = ("Sa", "Su", "Th")
+CLASS_NAME_INCLUDES = ("level 2", "ages 3")  # lowercase
+
+ORG_IDS = ["531495"]
+
+CACHE_DIR = Path(__file__).parent / ".cache"
+# bump when parsing or the Course fields change so stale caches are ignored
+CACHE_VERSION = 1
+# the course cache only holds prefiltered rows, so the prefilter is part of it
+CACHE_SETTINGS = repr((CACHE_VERSION, LOCATION, EXCLUDED_DAYS))
+
+TIME_RANGE_RE = re.compile(
+    # hours 1-12 and minutes 00-59, as strptime's "%I:%M%p" accepts
+    r"\s*(1[0-2]|0?[1-9]):([0-5]\d)\s*([ap]m)"
+    r"\s*-\s*(1[0-2]|0?[1-9]):([0-5]\d)\s*([ap]m)\s*$",
+    re.IGNORECASE,
+)
+
+ROW_SELECTOR = "table#table-1 tbody tr.qweb-reg-openings-row"
+
+# requests doesn't document Session as thread-safe, so every thread that
+# fetches pages gets its own session and connection pool
+THREAD_LOCAL = threading.local()
+
+
+def get_session() -> requests.Session:
+    session = getattr(THREAD_LOCAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        THREAD_LOCAL.session = session
+    return session
+
+
+def load_validators(oid: str) -> Dict[str, str]:
+    path = CACHE_DIR / f"validators-{oid}.json"
+    # a missing or damaged file just means an unconditional request
+    try:
+        validators = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(validators, dict) or not all(
+        isinstance(k, str) and isinstance(v, str) for k, v in validators.items()
+    ):
+        return {}
+    return validators
+
+
+def save_validators(oid: str, response: requests.Response) -> None:
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    CACHE_DIR.mkdir(exist_ok=True)
+    path = CACHE_DIR / f"validators-{oid}.json"
+    path.write_text(json.dumps({k: v for k, v in validators.items() if v}))
 
 
-def get_page() -> str:
+def get_page(oid: str, validators: Dict[str, str]) -> requests.Response:
     base_url = "https://app.jackrabbitclass.com/webregopeningsv2.asp"
     params = {
         "searchpage": "29750",
@@ -37,57 +127,87 @@ def get_page() -> str:
         "rc": "0,1,2,3",
         "hc": "0,11",
         "hcat1": "no",
-        "oid": "531495",
+        "oid": oid,
         "filterClasses": "",
         "waitlistClasses": "",
     }
 
-    response = requests.get(base_url, params=params)
+    headers: Dict[str, str] = {}
+    if "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if "last_modified" in validators:
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    response = get_session().get(base_url, params=params, headers=headers, timeout=10)
     response.raise_for_status()
-    return response.text
+    return response
 
 
-def parse_time_range(time_range_str: str):
-    start_str, end_str = time_range_str.split("-")
+def to_minutes(hour: str, minute: str, meridiem: str) -> int:
+    hour_of_day = int(hour) % 12
+    if meridiem.lower() == "pm":
+        hour_of_day += 12
+    return hour_of_day * 60 + int(minute)
 
-    # Define the format for parsing the time strings
-    time_format = "%I:%M%p"  # Example: 3:15pm
+
+def parse_time_range(time_range_str: str):
+    # Example: 3:15pm - 4:00pm
+    match = TIME_RANGE_RE.match(time_range_str)
+    assert match is not None, f"Unexpected time range '{time_range_str}'"
+    start_hour, start_minute, start_meridiem, end_hour, end_minute, end_meridiem = (
+        match.groups()
+    )
 
     # Parse the start and end times
-    start_time = datetime.strptime(start_str.strip(), time_format)
-    end_time = datetime.strptime(end_str.strip(), time_format)
+    start_min = to_minutes(start_hour, start_minute, start_meridiem)
+    end_min = to_minutes(end_hour, end_minute, end_meridiem)
 
-    return start_time, end_time
+    return start_min, end_min
 
 
-def find_and_get_text(row: Tag, attribute: str) -> str:
-    element = row.find("td", {"data-title": attribute})
-    assert element is not None, f"Element with data-title '{attribute}' not found"
-    text = element.get_text(strip=True)
-    return text
+def stripped_strings(node: Node) -> Generator[str, None, None]:
+    # iter() stays inside node; traverse() would run on into its siblings
+    for child in node.iter(include_text=True):
+        if child.tag == "-text":
+            text = child.text(strip=True)
+            if text:
+                yield text
+        else:
+            yield from stripped_strings(child)
 
 
-def extract_course_data(row: Tag) -> Course:
-    class_name_cell = row.find("th")
-    assert class_name_cell is not None
-    class_name_parts = [item.strip() for item in class_name_cell.stripped_strings]
-    class_name = (
-        class_name_parts[1] if len(class_name_parts) == 2 else class_name_parts[0]
-    )
+def extract_cells(row: Node) -> Dict[Optional[str], str]:
+    return {
+        td.attributes.get("data-title"): td.text(strip=True)
+        for td in row.iter()
+        if td.tag == "td"
+    }
 
-    location = find_and_get_text(row, "Location")
-    instructor = find_and_get_text(row, "Instructor")
-    session = find_and_get_text(row, "Session")
-    gender = find_and_get_text(row, "Gender")
-    age = find_and_get_text(row, "Age")
-    open = find_and_get_text(row, "Open")
-    cat2 = find_and_get_text(row, "Cat2")
-    cat3 = find_and_get_text(row, "Cat3")
-    days = find_and_get_text(row, "Days")
-    times = find_and_get_text(row, "Times")
-    fee = find_and_get_text(row, "Fee")
 
-    start_time, end_time = parse_time_range(times)
+def extract_course_data(row: Node, cells: Dict[Optional[str], str]) -> Course:
+    class_name_cell = row.css_first("th")
+    assert class_name_cell is not None
+    # the name is the second of exactly two strings, otherwise the first
+    class_name_parts = stripped_strings(class_name_cell)
+    first = next(class_name_parts, None)
+    assert first is not None, "Class name cell is empty"
+    second = next(class_name_parts, None)
+    third = next(class_name_parts, None)
+    class_name = second if second is not None and third is None else first
+
+    location = cells["Location"]
+    instructor = cells["Instructor"]
+    session = cells["Session"]
+    gender = cells["Gender"]
+    age = cells["Age"]
+    open = cells["Open"]
+    cat2 = cells["Cat2"]
+    cat3 = cells["Cat3"]
+    days = cells["Days"]
+    times = cells["Times"]
+    fee = cells["Fee"]
+
+    start_min, end_min = parse_time_range(times)
 
     return Course(
         class_name,
@@ -102,49 +222,113 @@ def extract_course_data(row: Tag) -> Course:
         days,
         times,
         fee,
-        start_time,
-        end_time,
+        start_min,
+        end_min,
     )
 
 
-def parse(html: str) -> Generator[Course, None, None]:
-    soup: BeautifulSoup = BeautifulSoup(html, "html.parser")
-    table = cast(Tag, soup.find("table", id="table-1"))
-    rows: List[Tag] = table.find("tbody").find_all("tr", class_="qweb-reg-openings-row")
+def good_location_and_day(location: str, days: str) -> bool:
+    return location == LOCATION and days not in EXCLUDED_DAYS
 
-    for row in rows:
-        assert isinstance(row, Tag)
-        yield extract_course_data(row)
 
+def extract_filtered(row: Node) -> Optional[Course]:
+    cells = extract_cells(row)
+    if not good_location_and_day(cells["Location"], cells["Days"]):
+        return None
+    return extract_course_data(row, cells)
 
-def relevant(row: Course) -> bool:
 
-    correct_class = (
-        "level 2" in row.class_name.lower() and "ages 3" in row.class_name.lower()
+def parse_filtered(html: bytes) -> Generator[Course, None, None]:
+    # rows that relevant() would reject on location or day are dropped
+    # before the class name and times are parsed
+    tree = HTMLParser(html)
+    rows = tree.css(ROW_SELECTOR)
+
+    # rows are extracted sequentially: the per-row work is Python code that
+    # holds the GIL, so a thread pool (which also had to reparse each row)
+    # measured about 2x slower even on very large tables
+    for row in rows:
+        course = extract_filtered(row)
+        if course is not None:
+            yield course
+
+
+def load_cached_courses(oid: str) -> Optional[Tuple[str, List[Course]]]:
+    path = CACHE_DIR / f"courses-{oid}.json"
+    # a missing, truncated or outdated cache file is just a cache miss
+    try:
+        cached = json.loads(path.read_text())
+        if cached["settings"] != CACHE_SETTINGS:
+            return None
+        return cached["hash"], [Course(**course) for course in cached["courses"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def parse_cached(oid: str, html: bytes) -> List[Course]:
+    digest = blake2b(html, digest_size=16).hexdigest()
+    cached = load_cached_courses(oid)
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+
+    courses = list(parse_filtered(html))
+    CACHE_DIR.mkdir(exist_ok=True)
+    path = CACHE_DIR / f"courses-{oid}.json"
+    path.write_text(
+        json.dumps(
+            {
+                "settings": CACHE_SETTINGS,
+                "hash": digest,
+                "courses": [course.to_json_dict() for course in courses],
+            }
+        )
     )
+    return courses
 
-    good_location = row.location == "SB"
 
-    start_after_time = datetime.strptime("5:00pm", "%I:%M%p").time()
-    end_before_time = datetime.strptime("7:30pm", "%I:%M%p").time()
-    good_time = (
-        row.start_time.time() >= start_after_time
-        and row.end_time.time() <= end_before_time
-    )
+def get_courses(oid: str) -> List[Course]:
+    # only ask for a 304 when there are cached courses to fall back on
+    cached = load_cached_courses(oid)
+    validators = load_validators(oid) if cached is not None else {}
 
-    good_day = row.days not in ["Sa", "Su", "Th"]
+    response = get_page(oid, validators)
+    if response.status_code == 304:
+        assert cached is not None
+        return cached[1]
 
-    return correct_class and good_location and good_time and good_day
+    courses = parse_cached(oid, response.content)
+    # saved last, so a failed parse is retried in full on the next run
+    save_validators(oid, response)
+    return courses
 
 
-def main():
-    for course in filter(relevant, parse(get_page())):
-        course_dict = dataclasses.asdict(course)
-        # datetime doesn't serialize so just remove it
-        del course_dict["start_time"]
-        del course_dict["end_time"]
+def get_all_courses(oids: List[str]) -> List[List[Course]]:
+    if len(oids) == 1:
+        return [get_courses(oids[0])]
+
+    # overlap the network round trips; each worker reuses its own session
+    with ThreadPoolExecutor(max_workers=min(len(oids), 16)) as executor:
+        return list(executor.map(get_courses, oids))
+
 
-        print(json.dumps(course_dict, indent=2))
+def relevant(row: Course) -> bool:
+    # cheapest checks first so most rows never reach the substring scans
+    if not good_location_and_day(row.location, row.days):
+        return False
+
+    if not (START_AFTER_MIN <= row.start_min and row.end_min <= END_BEFORE_MIN):
+        return False
+
+    return all(part in row.class_name_lc for part in CLASS_NAME_INCLUDES)
+
+
+def main():
+    for courses in get_all_courses(ORG_IDS):
+        for course in filter(relevant, courses):
+            sys.stdout.buffer.write(
+                orjson.dumps(course.to_json_dict(), option=orjson.OPT_INDENT_2)
+            )
+            sys.stdout.buffer.write(b"\n")
 
 
 if __name__ == "__main__":
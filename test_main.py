@@ -0,0 +1,222 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from selectolax.parser import HTMLParser, Node
+from typing import Dict, List
+import json
+import pytest
+import requests
+
+from main import (
+    extract_cells,
+    extract_course_data,
+    get_all_courses,
+    get_courses,
+    get_session,
+    load_validators,
+    parse_cached,
+    parse_filtered,
+    parse_time_range,
+    relevant,
+    stripped_strings,
+)
+import main
+
+
+def test_stripped_strings_stays_inside_cell():
+    tree = HTMLParser(
+        "<table><tbody><tr>"
+        "<th>Swim<span>Level 2 (ages 3-5)</span></th>"
+        '<td data-title="Location">SB</td>'
+        '<td data-title="Days">Mo</td>'
+        "</tr></tbody></table>"
+    )
+    th = tree.css_first("th")
+    assert th is not None
+    assert list(stripped_strings(th)) == ["Swim", "Level 2 (ages 3-5)"]
+
+
+def make_row_html(th: str, **overrides: str) -> str:
+    cells = {
+        "Location": "SB",
+        "Instructor": "Pat",
+        "Session": "Fall",
+        "Gender": "Any",
+        "Age": "3-5",
+        "Open": "2",
+        "Cat2": "",
+        "Cat3": "",
+        "Days": "Mo",
+        "Times": "5:00pm-5:30pm",
+        "Fee": "$10",
+        **overrides,
+    }
+    tds = "".join(
+        f'<td data-title="{title}">{text}</td>' for title, text in cells.items()
+    )
+    return f'<tr class="qweb-reg-openings-row"><th>{th}</th>{tds}</tr>'
+
+
+def make_page(*ths: str) -> bytes:
+    rows = "".join(make_row_html(th) for th in ths)
+    return f'<table id="table-1"><tbody>{rows}</tbody></table>'.encode()
+
+
+def make_row(th: str) -> Node:
+    tree = HTMLParser(make_page(th))
+    row = tree.css_first("tr")
+    assert row is not None
+    return row
+
+
+def test_class_name_uses_second_of_exactly_two_strings():
+    row = make_row("Swim<span>Level 2 (ages 3-5)</span>")
+    assert extract_course_data(row, extract_cells(row)).class_name == (
+        "Level 2 (ages 3-5)"
+    )
+
+
+def test_class_name_uses_first_of_one_or_three_strings():
+    row = make_row("Level 2 (ages 3-5)")
+    assert extract_course_data(row, extract_cells(row)).class_name == (
+        "Level 2 (ages 3-5)"
+    )
+
+    row = make_row("Swim<span>Level 2</span><span>ages 3</span>")
+    assert extract_course_data(row, extract_cells(row)).class_name == "Swim"
+
+
+def test_empty_class_name_cell_fails_clearly():
+    row = make_row("")
+    with pytest.raises(AssertionError, match="Class name cell is empty"):
+        extract_course_data(row, extract_cells(row))
+
+
+def test_parse_cached_reuses_courses_for_same_page(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(main, "CACHE_DIR", tmp_path)
+    page = make_page("Level 2 (ages 3-5)")
+    assert parse_cached("1", page) == parse_cached("1", page)
+    assert (tmp_path / "courses-1.json").exists()
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        '{"settings": "',
+        '{"settings": "old", "hash": "", "courses": []}',
+        json.dumps(
+            {"settings": main.CACHE_SETTINGS, "hash": "", "courses": [{"x": 1}]}
+        ),
+    ],
+)
+def test_parse_cached_treats_bad_cache_as_miss(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, contents: str
+):
+    monkeypatch.setattr(main, "CACHE_DIR", tmp_path)
+    (tmp_path / "courses-1.json").write_text(contents)
+    courses = parse_cached("1", make_page("Level 2 (ages 3-5)"))
+    assert [course.class_name for course in courses] == ["Level 2 (ages 3-5)"]
+
+
+@pytest.mark.parametrize("contents", ['{"etag": "', '["etag"]', '{"etag": 1}'])
+def test_load_validators_treats_bad_file_as_missing(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, contents: str
+):
+    monkeypatch.setattr(main, "CACHE_DIR", tmp_path)
+    (tmp_path / "validators-1.json").write_text(contents)
+    assert load_validators("1") == {}
+
+
+def make_response(status_code: int, content: bytes = b"") -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content  # pyright: ignore[reportPrivateUsage]
+    response.headers["ETag"] = '"v1"'
+    return response
+
+
+def test_get_courses_reuses_cache_on_not_modified(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(main, "CACHE_DIR", tmp_path)
+    page = make_page("Level 2 (ages 3-5)")
+
+    monkeypatch.setattr(main, "get_page", lambda oid, v: make_response(200, page))
+    first = get_courses("1")
+
+    def not_modified(oid: str, validators: Dict[str, str]) -> requests.Response:
+        assert validators == {"etag": '"v1"'}
+        return make_response(304)
+
+    monkeypatch.setattr(main, "get_page", not_modified)
+    assert get_courses("1") == first
+
+
+def test_get_courses_saves_validators_only_after_parsing(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(main, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(main, "get_page", lambda oid, v: make_response(200, b""))
+
+    def broken_parse(oid: str, html: bytes) -> List[main.Course]:
+        raise RuntimeError
+
+    monkeypatch.setattr(main, "parse_cached", broken_parse)
+    with pytest.raises(RuntimeError):
+        get_courses("1")
+    assert not (tmp_path / "validators-1.json").exists()
+
+
+def test_parse_time_range():
+    assert parse_time_range("5:00pm-7:30PM") == (17 * 60, 19 * 60 + 30)
+    assert parse_time_range(" 12:15am - 12:45pm ") == (15, 12 * 60 + 45)
+
+
+@pytest.mark.parametrize(
+    "time_range", ["13:00pm-2:00pm", "0:30am-1:00am", "1:75am-2:00am", "5pm-6pm"]
+)
+def test_parse_time_range_rejects_malformed_times(time_range: str):
+    with pytest.raises(AssertionError):
+        parse_time_range(time_range)
+
+
+def test_relevant_agrees_with_parse_filtered():
+    th = "Level 2 (ages 3-5)"
+    rows = "".join(
+        make_row_html(th, Location=location, Days=days)
+        for location in ("SB", "NB")
+        for days in ("Mo", "Sa", "Th")
+    )
+    page = f'<table id="table-1"><tbody>{rows}</tbody></table>'.encode()
+
+    all_courses = [
+        extract_course_data(row, extract_cells(row))
+        for row in HTMLParser(page).css("tr")
+    ]
+    expected = [course for course in all_courses if relevant(course)]
+    assert expected
+    assert [c for c in parse_filtered(page) if relevant(c)] == expected
+
+
+def test_get_all_courses_keeps_oid_order(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(main, "CACHE_DIR", tmp_path)
+    pages = {oid: make_page(f"Class {oid}") for oid in ("1", "2", "3")}
+    monkeypatch.setattr(
+        main, "get_page", lambda oid, v: make_response(200, pages[oid])
+    )
+
+    all_courses = get_all_courses(["3", "1", "2"])
+    assert [[c.class_name for c in courses] for courses in all_courses] == [
+        ["Class 3"],
+        ["Class 1"],
+        ["Class 2"],
+    ]
+
+
+def test_get_session_is_per_thread():
+    assert get_session() is get_session()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(get_session).result() is not get_session()